@@ -4,7 +4,7 @@ Flask application factory for the Library application.
 
 from flask import Flask
 from flask_cors import CORS
-from app.database import init_db
+from app.database import init_db, close_db
 import os
 
 
@@ -30,6 +30,9 @@ def create_app():
         os.makedirs('data', exist_ok=True)
         init_db()
     
+    # Return pooled database connections at the end of each request
+    app.teardown_appcontext(close_db)
+    
     # Register blueprints (routes)
     from app.routes.users import users_bp
     from app.routes.books import books_bp
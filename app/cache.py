@@ -0,0 +1,59 @@
+"""
+In-process caching helpers for the Library application.
+Cached values live in the worker process and expire after a fixed TTL.
+"""
+
+import threading
+import time
+from functools import wraps
+
+# Incremented whenever a checkout is created or returned. Cache keys that
+# include it stop matching as soon as checkout data changes.
+_checkouts_version = 0
+_version_lock = threading.Lock()
+
+
+def get_checkouts_version():
+    """
+    Return the current checkouts version counter.
+    """
+    return _checkouts_version
+
+
+def bump_checkouts_version():
+    """
+    Invalidate cached results that depend on checkout data.
+    """
+    global _checkouts_version
+    with _version_lock:
+        _checkouts_version += 1
+
+
+def ttl_cache(ttl, maxsize=128):
+    """
+    Decorator that caches a function's result per positional arguments
+    for ttl seconds. The cache is emptied once it holds maxsize entries.
+    """
+    def decorator(func):
+        entries = {}
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = entries.get(args)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+            value = func(*args)
+            with lock:
+                if len(entries) >= maxsize:
+                    entries.clear()
+                entries[args] = (now + ttl, value)
+            return value
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
@@ -5,29 +5,128 @@ Handles SQLite database connections and schema creation.
 
 import sqlite3
 import os
+import queue
 from datetime import datetime, timedelta
+from flask import g
 
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'data/library.db')
 
+# Worker threads run.py starts the WSGI server with
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
 
-def get_db_connection():
+# Number of idle connections kept open for reuse (one per worker thread)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', WEB_THREADS))
+
+# Compiled statements cached per connection (sqlite3 default is 128)
+CACHED_STATEMENTS = 512
+
+# Applied once when a pooled connection is opened:
+# NORMAL sync is safe under WAL (set persistently by init_db), and a 64MB
+# page cache plus 256MB mmap keep hot pages out of read() calls.
+CONNECTION_PRAGMAS = '''
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -65536;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA foreign_keys = ON;
+    PRAGMA analysis_limit = 400;
+'''
+
+# Public book fields, in table order. Hot read paths select these explicitly
+# and zip them against plain tuple rows instead of going through sqlite3.Row.
+BOOK_COLS = ('book_id', 'isbn', 'title', 'author', 'year_published', 'genre',
+             'image_url', 'is_booked', 'booked_by_user_id', 'due_date')
+BOOK_COLUMNS = ', '.join(BOOK_COLS)
+
+_pool = queue.Queue(maxsize=POOL_SIZE)
+
+
+def _create_connection():
     """
-    Create and return a database connection.
-    Uses Row factory for dictionary-like access to rows.
+    Open a new database connection.
+    Rows come back as plain tuples; use row_cursor() where a handler
+    needs access by column name.
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS)
+    conn.executescript(CONNECTION_PRAGMAS)
     return conn
 
 
+def row_cursor(conn):
+    """
+    Return a cursor that yields sqlite3.Row objects for dictionary-like access.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor
+
+
+def get_db_connection():
+    """
+    Take a connection from the pool, opening a new one if none are idle.
+    Hand it back with release_db_connection() when finished.
+    """
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _create_connection()
+
+
+def release_db_connection(conn):
+    """
+    Return a connection to the pool so later requests can reuse it.
+    Any uncommitted work is rolled back; the connection is closed if the
+    pool is already full.
+    """
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def get_db():
+    """
+    Get the connection for the current request.
+    The connection is stored on flask.g and released on app context teardown.
+    """
+    if '_db' not in g:
+        g._db = get_db_connection()
+    return g._db
+
+
+def close_db(exception=None):
+    """
+    Release the current request's connection back to the pool.
+    Registered as a teardown_appcontext handler in create_app().
+    Runs PRAGMA optimize first so planner statistics stay current.
+    """
+    conn = g.pop('_db', None)
+    if conn is not None:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            conn.execute('PRAGMA optimize')
+        except sqlite3.OperationalError:
+            # Best effort: skip if a writer currently holds the lock
+            pass
+        release_db_connection(conn)
+
+
 def init_db():
     """
     Initialize the database with all required tables.
     Called once when the application starts.
     """
-    conn = get_db_connection()
+    conn = _create_connection()
     cursor = conn.cursor()
     
+    # WAL lets readers run alongside the writer. The mode is stored in the
+    # database file, so it only needs setting here rather than per connection.
+    cursor.execute('PRAGMA journal_mode = WAL')
+    
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -51,10 +150,16 @@ def init_db():
             is_booked INTEGER DEFAULT 0,
             booked_by_user_id INTEGER,
             due_date TIMESTAMP,
+            checkout_count_7d INTEGER DEFAULT 0,
             FOREIGN KEY (booked_by_user_id) REFERENCES users(user_id)
         )
     ''')
     
+    # Databases created before checkout_count_7d existed need the column added
+    cursor.execute('PRAGMA table_info(books)')
+    if 'checkout_count_7d' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE books ADD COLUMN checkout_count_7d INTEGER DEFAULT 0')
+    
     # Checkouts table (history of all checkouts for trending/recommendations)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS checkouts (
@@ -83,27 +188,131 @@ def init_db():
         )
     ''')
     
+    # Book availability and the trending counter are derived from checkouts.
+    # Triggers keep the denormalized books columns in step with every
+    # checkout and return, so handlers only write the checkouts row.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS checkouts_ai AFTER INSERT ON checkouts
+        WHEN new.is_returned = 0 BEGIN
+            UPDATE books
+            SET is_booked = 1, booked_by_user_id = new.user_id, due_date = new.due_date,
+                checkout_count_7d = checkout_count_7d + 1
+            WHERE book_id = new.book_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS checkouts_au AFTER UPDATE OF is_returned ON checkouts
+        WHEN new.is_returned = 1 AND old.is_returned = 0 BEGIN
+            UPDATE books
+            SET is_booked = 0, booked_by_user_id = NULL, due_date = NULL
+            WHERE book_id = new.book_id;
+        END
+    ''')
+    
+    # Full-text index over books for title/author/genre search. It uses the
+    # books table as external content, so only the token index is stored;
+    # triggers keep it in sync with books.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+    fts_exists = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genre,
+            content='books', content_rowid='book_id'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.book_id, new.title, new.author, new.genre);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.book_id, old.title, old.author, old.genre);
+        END
+    ''')
+    # Only fires for the indexed columns, so availability updates skip it
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, genre ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.book_id, old.title, old.author, old.genre);
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.book_id, new.title, new.author, new.genre);
+        END
+    ''')
+    
+    # Index books that were loaded before the full-text table existed
+    if not fts_exists:
+        cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+    
     # Create indexes for better query performance (can be removed to test slow queries)
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_author ON books(author)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_author_year ON books(author, year_published)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_year ON books(year_published)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_genre ON books(genre)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_user ON checkouts(user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_book ON checkouts(book_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_checkout_count ON books(checkout_count_7d)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_user_date ON checkouts(user_id, checkout_date DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_active ON checkouts(user_id, is_returned, checkout_date DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_book_date ON checkouts(book_id, checkout_date)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_date ON checkouts(checkout_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reviews_book ON reviews(book_id)')
+    
+    # Single-column indexes made redundant by the composites above
+    cursor.execute('DROP INDEX IF EXISTS idx_books_author')
+    cursor.execute('DROP INDEX IF EXISTS idx_checkouts_user')
+    cursor.execute('DROP INDEX IF EXISTS idx_checkouts_book')
+    
+    # Indexes older versions of data/import_data.py created: idx_isbn
+    # duplicates the UNIQUE(isbn) index, idx_author is a prefix of
+    # idx_books_author_year and idx_year duplicates idx_books_year
+    cursor.execute('DROP INDEX IF EXISTS idx_isbn')
+    cursor.execute('DROP INDEX IF EXISTS idx_author')
+    cursor.execute('DROP INDEX IF EXISTS idx_year')
     
     conn.commit()
+    
+    # Refresh planner statistics so the new indexes are picked up
+    cursor.execute('ANALYZE')
     conn.close()
     print("Database initialized successfully!")
 
 
+def refresh_checkout_counts(conn):
+    """
+    Recompute books.checkout_count_7d from the last 7 days of checkouts.
+    The checkouts_ai trigger increments the counter as checkouts happen;
+    this sweep removes checkouts that have aged out of the window.
+    Raises sqlite3.OperationalError if the write lock cannot be taken.
+    """
+    seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    # Take the write lock before the first UPDATE so a concurrent writer
+    # makes this wait on the busy timeout instead of failing mid-transaction
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('UPDATE books SET checkout_count_7d = 0 WHERE checkout_count_7d != 0')
+    conn.execute('''
+        UPDATE books
+        SET checkout_count_7d = (
+            SELECT COUNT(*) FROM checkouts c
+            WHERE c.book_id = books.book_id AND c.checkout_date >= ?
+        )
+        WHERE book_id IN (SELECT book_id FROM checkouts WHERE checkout_date >= ?)
+    ''', (seven_days_ago, seven_days_ago))
+    conn.commit()
+
+
 def drop_all_tables():
     """
     Drop all tables - useful for resetting the database during development.
     """
-    conn = get_db_connection()
+    conn = _create_connection()
     cursor = conn.cursor()
     
+    # Referencing tables first, since foreign keys are enforced
+    cursor.execute('DROP TABLE IF EXISTS reviews')
     cursor.execute('DROP TABLE IF EXISTS checkouts')
+    cursor.execute('DROP TABLE IF EXISTS books_fts')
     cursor.execute('DROP TABLE IF EXISTS books')
     cursor.execute('DROP TABLE IF EXISTS users')
     
@@ -3,11 +3,124 @@ Book routes for the Library application.
 Handles book listing, searching, filtering, and availability updates.
 """
 
-from flask import Blueprint, request, jsonify
-from app.database import get_db_connection
+import itertools
+import sqlite3
+import orjson
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from app.database import get_db, BOOK_COLS, BOOK_COLUMNS
+from app.cache import ttl_cache
 
 books_bp = Blueprint('books', __name__)
 
+# Hot queries kept as constants so every call hits the statement cache
+SQL_GET_BOOK = f'SELECT {BOOK_COLUMNS} FROM books WHERE book_id = ?'
+
+# One statement returns a page of books and the total match count. The count
+# is an uncorrelated subquery, evaluated once and able to use covering
+# indexes; COUNT(*) OVER () would materialize every match before the LIMIT.
+PAGE_QUERY = ('SELECT (SELECT COUNT(*) FROM books {where}) AS _total, ' + BOOK_COLUMNS +
+              ' FROM books {where} ORDER BY {sort_by} {order} LIMIT ? OFFSET ?')
+
+# Columns /api/books can sort by ('year' is accepted as an alias)
+SORT_FIELDS = ('title', 'author', 'year_published', 'book_id')
+
+SQL_SEARCH_BOOKS = f'''
+    SELECT {BOOK_COLUMNS} FROM books_fts f
+    JOIN books b ON b.book_id = f.rowid
+    WHERE books_fts MATCH ?
+    LIMIT ?
+'''
+
+# Seconds to cache filter options; they only change when books are imported
+FILTER_OPTIONS_TTL = 300
+
+
+def fts_phrase(text):
+    """
+    Quote user input as an FTS5 prefix phrase, e.g. 'harry pot' -> "harry pot"*.
+    Quoting keeps FTS operators and punctuation in the input from being parsed.
+    """
+    return '"' + text.replace('"', '""') + '"*'
+
+
+def fts_searchable(text):
+    """
+    True if text contains something the FTS5 tokenizer indexes. Input made
+    only of punctuation (e.g. '-' or '...') becomes an empty phrase that
+    matches nothing, so it has to go through LIKE instead.
+    """
+    return any(c.isalnum() for c in text)
+
+
+def build_where(search, author, year, genre, available, use_fts=True):
+    """
+    Build the WHERE clause shared by the book listing and its count.
+    Returns (sql, params) where sql starts with 'WHERE'.
+    
+    Text filters go through the books_fts full-text index; pass
+    use_fts=False to fall back to LIKE substring matching.
+    """
+    query = 'WHERE 1=1'
+    params = []
+    
+    if use_fts:
+        terms = []
+        if search:
+            terms.append('title : ' + fts_phrase(search))
+        if author:
+            terms.append('author : ' + fts_phrase(author))
+        if genre:
+            terms.append('genre : ' + fts_phrase(genre))
+        
+        if terms:
+            query += ' AND book_id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)'
+            params.append(' AND '.join(terms))
+    else:
+        if search:
+            query += ' AND title LIKE ?'
+            params.append(f'%{search}%')
+        
+        if author:
+            query += ' AND author LIKE ?'
+            params.append(f'%{author}%')
+        
+        if genre:
+            query += ' AND genre LIKE ?'
+            params.append(f'%{genre}%')
+    
+    if year:
+        query += ' AND year_published = ?'
+        params.append(int(year))
+    
+    if available.lower() == 'true':
+        query += ' AND is_booked = 0'
+    elif available.lower() == 'false':
+        query += ' AND is_booked = 1'
+    
+    return query, params
+
+
+def _build_page_queries():
+    """
+    Render the page query for every sort and filter combination, so each
+    request binds parameters to one of a fixed set of SQL strings.
+    The WHERE text only depends on which filters are set, so placeholder
+    values stand in for the real ones.
+    """
+    queries = {}
+    for key in itertools.product(SORT_FIELDS, ('ASC', 'DESC'),
+                                 (False, True), (False, True), (False, True), (False, True),
+                                 ('', 'true', 'false')):
+        sort_by, order, has_search, has_author, has_year, has_genre, available = key
+        where, _ = build_where('x' if has_search else '', 'x' if has_author else '',
+                               '0' if has_year else '', 'x' if has_genre else '', available)
+        queries[key] = PAGE_QUERY.format(where=where, sort_by=sort_by, order=order)
+    return queries
+
+
+# Keyed by (sort_by, order, has_search, has_author, has_year, has_genre, available)
+PAGE_QUERIES = _build_page_queries()
+
 
 @books_bp.route('', methods=['GET'])
 def get_books():
@@ -37,83 +150,59 @@ def get_books():
     limit = request.args.get('limit', 20, type=int)
     offset = request.args.get('offset', 0, type=int)
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
-    
-    # Build query dynamically
-    query = 'SELECT * FROM books WHERE 1=1'
-    params = []
-    
-    if search:
-        query += ' AND title LIKE ?'
-        params.append(f'%{search}%')
-    
-    if author:
-        query += ' AND author LIKE ?'
-        params.append(f'%{author}%')
-    
-    if year:
-        query += ' AND year_published = ?'
-        params.append(int(year))
-    
-    if genre:
-        query += ' AND genre LIKE ?'
-        params.append(f'%{genre}%')
-    
-    if available.lower() == 'true':
-        query += ' AND is_booked = 0'
-    elif available.lower() == 'false':
-        query += ' AND is_booked = 1'
+    cursor.arraysize = 200
     
     # Sorting
-    valid_sort_fields = ['title', 'author', 'year_published', 'book_id']
     if sort_by == 'year':
         sort_by = 'year_published'
-    if sort_by not in valid_sort_fields:
+    if sort_by not in SORT_FIELDS:
         sort_by = 'title'
     
     order = 'DESC' if order.lower() == 'desc' else 'ASC'
-    query += f' ORDER BY {sort_by} {order}'
-    
-    # Pagination
-    query += ' LIMIT ? OFFSET ?'
-    params.extend([limit, offset])
-    
-    cursor.execute(query, params)
-    books = cursor.fetchall()
     
-    # Get total count for pagination
-    count_query = 'SELECT COUNT(*) as total FROM books WHERE 1=1'
-    count_params = []
-    
-    if search:
-        count_query += ' AND title LIKE ?'
-        count_params.append(f'%{search}%')
-    if author:
-        count_query += ' AND author LIKE ?'
-        count_params.append(f'%{author}%')
-    if year:
-        count_query += ' AND year_published = ?'
-        count_params.append(int(year))
-    if genre:
-        count_query += ' AND genre LIKE ?'
-        count_params.append(f'%{genre}%')
-    if available.lower() == 'true':
-        count_query += ' AND is_booked = 0'
-    elif available.lower() == 'false':
-        count_query += ' AND is_booked = 1'
-    
-    cursor.execute(count_query, count_params)
-    total = cursor.fetchone()['total']
-    
-    conn.close()
-    
-    return jsonify({
-        'books': [dict(book) for book in books],
-        'total': total,
-        'limit': limit,
-        'offset': offset
-    }), 200
+    available = available.lower()
+    if available not in ('true', 'false'):
+        available = ''
+    
+    use_fts = all(fts_searchable(text) for text in (search, author, genre) if text)
+    if use_fts:
+        where, params = build_where(search, author, year, genre, available)
+        query_key = (sort_by, order, bool(search), bool(author), bool(year), bool(genre), available)
+        try:
+            cursor.execute(PAGE_QUERIES[query_key], params + params + [limit, offset])
+        except sqlite3.OperationalError:
+            # Full-text query rejected; retry with LIKE matching
+            use_fts = False
+    
+    if not use_fts:
+        where, params = build_where(search, author, year, genre, available, use_fts=False)
+        cursor.execute(PAGE_QUERY.format(where=where, sort_by=sort_by, order=order),
+                       params + params + [limit, offset])
+    
+    def generate():
+        # Serialize each fetchmany() batch as it comes off the cursor instead
+        # of building the whole result list; every row is (total, *BOOK_COLS)
+        yield b'{"books":['
+        total = None
+        rows = cursor.fetchmany()
+        while rows:
+            separator = b'' if total is None else b','
+            total = rows[0][0]
+            yield separator + b','.join(orjson.dumps(dict(zip(BOOK_COLS, row[1:])))
+                                        for row in rows)
+            rows = cursor.fetchmany()
+        
+        if total is None and (offset > 0 or limit <= 0):
+            # Paged past the end or asked for no rows: nothing carried the
+            # total, so count directly
+            cursor.execute(f'SELECT COUNT(*) FROM books {where}', params)
+            total = cursor.fetchone()[0]
+        
+        yield b'],"total":%d,"limit":%d,"offset":%d}\n' % (total or 0, limit, offset)
+    
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
 
 
 @books_bp.route('/<int:book_id>', methods=['GET'])
@@ -122,15 +211,14 @@ def get_book(book_id):
     Get a specific book by ID.
     GET /api/books/<book_id>
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
+    cursor.execute(SQL_GET_BOOK, (book_id,))
     book = cursor.fetchone()
-    conn.close()
     
     if book:
-        return jsonify(dict(book)), 200
+        return jsonify(dict(zip(BOOK_COLS, book))), 200
     else:
         return jsonify({'error': 'Book not found'}), 404
 
@@ -147,17 +235,6 @@ def update_book(book_id):
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if book exists
-    cursor.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
-    book = cursor.fetchone()
-    
-    if not book:
-        conn.close()
-        return jsonify({'error': 'Book not found'}), 404
-    
     # Build update query dynamically
     update_fields = []
     params = []
@@ -170,23 +247,29 @@ def update_book(book_id):
             params.append(data[field])
     
     if not update_fields:
-        conn.close()
         return jsonify({'error': 'No valid fields to update'}), 400
     
-    params.append(book_id)
-    query = f"UPDATE books SET {', '.join(update_fields)} WHERE book_id = ?"
+    conn = get_db()
+    cursor = conn.cursor()
     
-    cursor.execute(query, params)
-    conn.commit()
+    # Update and read back the row in one statement; no row means no such book
+    params.append(book_id)
+    query = f"UPDATE books SET {', '.join(update_fields)} WHERE book_id = ? RETURNING {BOOK_COLUMNS}"
     
-    # Fetch updated book
-    cursor.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
+    try:
+        cursor.execute(query, params)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'booked_by_user_id does not match an existing user'}), 400
     updated_book = cursor.fetchone()
-    conn.close()
+    
+    if not updated_book:
+        return jsonify({'error': 'Book not found'}), 404
+    
+    conn.commit()
     
     return jsonify({
         'message': 'Book updated successfully',
-        'book': dict(updated_book)
+        'book': dict(zip(BOOK_COLS, updated_book))
     }), 200
 
 
@@ -214,8 +297,10 @@ def options_books(book_id=None):
 @books_bp.route('/search', methods=['GET'])
 def search_books():
     """
-    Search books by title (convenience endpoint).
+    Search books by title or author (convenience endpoint).
     GET /api/books/search?q=<query>
+    
+    Matches words starting with the query via the books_fts index.
     """
     query = request.args.get('q', '')
     limit = request.args.get('limit', 20, type=int)
@@ -223,23 +308,29 @@ def search_books():
     if not query:
         return jsonify({'error': 'Search query is required'}), 400
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Intentionally inefficient search for performance testing
-    # This does a full table scan with LIKE
-    cursor.execute(
-        '''SELECT * FROM books 
-           WHERE title LIKE ? OR author LIKE ?
-           LIMIT ?''',
-        (f'%{query}%', f'%{query}%', limit)
-    )
+    use_fts = fts_searchable(query)
+    if use_fts:
+        try:
+            cursor.execute(SQL_SEARCH_BOOKS, ('{title author} : ' + fts_phrase(query), limit))
+        except sqlite3.OperationalError:
+            # Full-text query rejected; fall back to a LIKE scan
+            use_fts = False
+    
+    if not use_fts:
+        cursor.execute(
+            f'''SELECT {BOOK_COLUMNS} FROM books
+               WHERE title LIKE ? OR author LIKE ?
+               LIMIT ?''',
+            (f'%{query}%', f'%{query}%', limit)
+        )
     books = cursor.fetchall()
-    conn.close()
     
     return jsonify({
         'query': query,
-        'results': [dict(book) for book in books],
+        'results': [dict(zip(BOOK_COLS, book)) for book in books],
         'count': len(books)
     }), 200
 
@@ -249,26 +340,35 @@ def get_filter_options():
     """
     Get available filter options (unique authors, years, genres).
     GET /api/books/filters
+    
+    The serialized body is cached for FILTER_OPTIONS_TTL seconds.
+    """
+    return current_app.response_class(_filter_options_json(), mimetype='application/json'), 200
+
+
+@ttl_cache(FILTER_OPTIONS_TTL)
+def _filter_options_json():
+    """
+    Query the filter options and return them serialized as JSON.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get unique authors
     cursor.execute('SELECT DISTINCT author FROM books ORDER BY author LIMIT 100')
-    authors = [row['author'] for row in cursor.fetchall()]
+    authors = [row[0] for row in cursor.fetchall()]
     
     # Get unique years
     cursor.execute('SELECT DISTINCT year_published FROM books WHERE year_published IS NOT NULL ORDER BY year_published DESC')
-    years = [row['year_published'] for row in cursor.fetchall()]
+    years = [row[0] for row in cursor.fetchall()]
     
     # Get unique genres
     cursor.execute('SELECT DISTINCT genre FROM books WHERE genre IS NOT NULL ORDER BY genre')
-    genres = [row['genre'] for row in cursor.fetchall()]
-    
-    conn.close()
+    genres = [row[0] for row in cursor.fetchall()]
     
-    return jsonify({
+    # Same compact layout jsonify() produces
+    return current_app.json.dumps({
         'authors': authors,
         'years': years,
         'genres': genres
-    }), 200
+    }, separators=(',', ':')) + '\n'
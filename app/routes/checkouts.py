@@ -3,12 +3,77 @@ Checkout routes for the Library application.
 Handles book checkout and return operations.
 """
 
-from flask import Blueprint, request, jsonify
-from app.database import get_db_connection
+import sqlite3
+import orjson
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from app.database import get_db, row_cursor
+from app.cache import ttl_cache, get_checkouts_version, bump_checkouts_version
 from datetime import datetime, timedelta
 
 checkouts_bp = Blueprint('checkouts', __name__)
 
+# Seconds to cache checkout reads. Cache keys include the checkouts version,
+# so checking out or returning a book invalidates them immediately.
+CHECKOUTS_TTL = 30
+
+# Checkout fields returned by the read endpoints, in table order
+CHECKOUT_COLUMNS = ('c.checkout_id, c.book_id, c.user_id, c.checkout_date,'
+                    ' c.return_date, c.due_date, c.is_returned')
+
+# Hot queries kept as constants so every call hits the statement cache
+
+# Inserts nothing unless the book exists and is available
+SQL_CREATE_CHECKOUT = '''
+    INSERT INTO checkouts (book_id, user_id, due_date)
+    SELECT book_id, ?, ? FROM books
+    WHERE book_id = ? AND is_booked = 0
+'''
+
+# Updates nothing unless the checkout is still open
+SQL_RETURN_CHECKOUT = '''
+    UPDATE checkouts
+    SET is_returned = 1, return_date = ?
+    WHERE checkout_id = ? AND is_returned = 0
+    RETURNING book_id
+'''
+
+SQL_USER_EXISTS = 'SELECT user_id FROM users WHERE user_id = ?'
+SQL_BOOK_DUE_DATE = 'SELECT due_date FROM books WHERE book_id = ?'
+SQL_CHECKOUT_EXISTS = 'SELECT checkout_id FROM checkouts WHERE checkout_id = ?'
+
+# The WHERE clause is joined from filter fragments, then the ORDER BY
+SQL_LIST_CHECKOUTS = f'''
+    SELECT {CHECKOUT_COLUMNS}, b.title, b.author, b.image_url
+    FROM checkouts c
+    JOIN books b ON c.book_id = b.book_id
+'''
+
+# ?active= values and the is_returned value each one selects
+ACTIVE_FILTERS = {'true': 0, 'false': 1}
+
+SQL_GET_CHECKOUT = f'''
+    SELECT {CHECKOUT_COLUMNS}, b.title, b.author, b.image_url
+    FROM checkouts c
+    JOIN books b ON c.book_id = b.book_id
+    WHERE c.checkout_id = ?
+'''
+
+SQL_USER_HISTORY = f'''
+    SELECT {CHECKOUT_COLUMNS}, b.title, b.author, b.year_published, b.genre, b.image_url
+    FROM checkouts c
+    JOIN books b ON c.book_id = b.book_id
+    WHERE c.user_id = ?
+    ORDER BY c.checkout_date DESC
+'''
+
+
+def rows_to_dicts(cursor):
+    """
+    Fetch the remaining rows of a plain tuple cursor as dicts keyed by column name.
+    """
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
 
 @checkouts_bp.route('', methods=['POST'])
 def checkout_book():
@@ -25,53 +90,48 @@ def checkout_book():
     book_id = data['book_id']
     user_id = data['user_id']
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Calculate due date (7 days from now)
+    due_date = datetime.now() + timedelta(days=7)
+    due_date_str = due_date.strftime('%Y-%m-%d %H:%M:%S')
     
-    # Check if user exists
-    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'error': 'User not found'}), 404
+    conn = get_db()
+    cursor = conn.cursor()
     
-    # Check if book exists and is available
-    cursor.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
-    book = cursor.fetchone()
+    # Take the write lock up front so the availability check and the insert
+    # cannot interleave with another checkout of the same book
+    cursor.execute('BEGIN IMMEDIATE')
     
-    if not book:
-        conn.close()
-        return jsonify({'error': 'Book not found'}), 404
+    # Create the checkout record only if the book is available (the
+    # checkouts_ai trigger then marks it as booked). An unknown user fails
+    # the foreign key.
+    try:
+        cursor.execute(SQL_CREATE_CHECKOUT, (user_id, due_date_str, book_id))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return jsonify({'error': 'User not found'}), 404
     
-    if book['is_booked'] == 1:
-        conn.close()
+    if cursor.rowcount == 0:
+        # Nothing inserted: work out why before releasing the lock
+        cursor.execute(SQL_USER_EXISTS, (user_id,))
+        user = cursor.fetchone()
+        cursor.execute(SQL_BOOK_DUE_DATE, (book_id,))
+        book = cursor.fetchone()
+        conn.rollback()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        if not book:
+            return jsonify({'error': 'Book not found'}), 404
         return jsonify({
             'error': 'Book is not available',
             'message': 'This book is currently checked out by another user',
-            'due_date': book['due_date']
+            'due_date': book[0]
         }), 409
     
-    # Calculate due date (7 days from now)
-    due_date = datetime.now() + timedelta(days=7)
-    due_date_str = due_date.strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Update book availability
-    cursor.execute(
-        '''UPDATE books 
-           SET is_booked = 1, booked_by_user_id = ?, due_date = ?
-           WHERE book_id = ?''',
-        (user_id, due_date_str, book_id)
-    )
-    
-    # Create checkout record
-    cursor.execute(
-        '''INSERT INTO checkouts (book_id, user_id, due_date)
-           VALUES (?, ?, ?)''',
-        (book_id, user_id, due_date_str)
-    )
     checkout_id = cursor.lastrowid
     
     conn.commit()
-    conn.close()
+    bump_checkouts_version()
     
     return jsonify({
         'message': 'Book checked out successfully',
@@ -88,45 +148,27 @@ def return_book(checkout_id):
     Return a book (complete a checkout).
     DELETE /api/checkouts/<checkout_id>
     """
-    conn = get_db_connection()
+    return_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get checkout record
-    cursor.execute(
-        'SELECT * FROM checkouts WHERE checkout_id = ?',
-        (checkout_id,)
-    )
+    # Close the checkout only if it is still open (the checkouts_au trigger
+    # makes the book available); one statement, so two returns cannot race
+    cursor.execute(SQL_RETURN_CHECKOUT, (return_date, checkout_id))
     checkout = cursor.fetchone()
     
     if not checkout:
-        conn.close()
-        return jsonify({'error': 'Checkout not found'}), 404
-    
-    if checkout['is_returned'] == 1:
-        conn.close()
+        conn.rollback()
+        cursor.execute(SQL_CHECKOUT_EXISTS, (checkout_id,))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Checkout not found'}), 404
         return jsonify({'error': 'Book has already been returned'}), 400
     
-    book_id = checkout['book_id']
-    return_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Update checkout record
-    cursor.execute(
-        '''UPDATE checkouts 
-           SET is_returned = 1, return_date = ?
-           WHERE checkout_id = ?''',
-        (return_date, checkout_id)
-    )
-    
-    # Update book availability
-    cursor.execute(
-        '''UPDATE books 
-           SET is_booked = 0, booked_by_user_id = NULL, due_date = NULL
-           WHERE book_id = ?''',
-        (book_id,)
-    )
+    book_id = checkout[0]
     
     conn.commit()
-    conn.close()
+    bump_checkouts_version()
     
     return jsonify({
         'message': 'Book returned successfully',
@@ -143,38 +185,42 @@ def get_checkouts():
     GET /api/checkouts?user_id=<int>&active=<true/false>
     """
     user_id = request.args.get('user_id', type=int)
-    active = request.args.get('active', '')
+    is_returned = ACTIVE_FILTERS.get(request.args.get('active', '').lower())
     
-    conn = get_db_connection()
+    body = _get_checkouts(user_id, is_returned, get_checkouts_version())
+    return current_app.response_class(body, mimetype='application/json'), 200
+
+
+@ttl_cache(CHECKOUTS_TTL, maxsize=1024)
+def _get_checkouts(user_id, is_returned, checkouts_version):
+    """
+    Query the checkout listing for one set of filters and return it
+    serialized as JSON. is_returned is 0, 1 or None for no filter;
+    checkouts_version only forms part of the cache key.
+    """
+    conn = get_db()
     cursor = conn.cursor()
     
-    query = '''
-        SELECT c.*, b.title, b.author, b.image_url
-        FROM checkouts c
-        JOIN books b ON c.book_id = b.book_id
-        WHERE 1=1
-    '''
+    where = ['1=1']
     params = []
     
     if user_id:
-        query += ' AND c.user_id = ?'
+        where.append('c.user_id = ?')
         params.append(user_id)
     
-    if active.lower() == 'true':
-        query += ' AND c.is_returned = 0'
-    elif active.lower() == 'false':
-        query += ' AND c.is_returned = 1'
-    
-    query += ' ORDER BY c.checkout_date DESC'
+    if is_returned is not None:
+        where.append('c.is_returned = ?')
+        params.append(is_returned)
     
+    query = (SQL_LIST_CHECKOUTS + ' WHERE ' + ' AND '.join(where) +
+             ' ORDER BY c.checkout_date DESC')
     cursor.execute(query, params)
-    checkouts = cursor.fetchall()
-    conn.close()
+    checkouts = rows_to_dicts(cursor)
     
-    return jsonify({
-        'checkouts': [dict(checkout) for checkout in checkouts],
+    return orjson.dumps({
+        'checkouts': checkouts,
         'count': len(checkouts)
-    }), 200
+    }, option=orjson.OPT_APPEND_NEWLINE)
 
 
 @checkouts_bp.route('/<int:checkout_id>', methods=['GET'])
@@ -183,47 +229,56 @@ def get_checkout(checkout_id):
     Get a specific checkout by ID.
     GET /api/checkouts/<checkout_id>
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''SELECT c.*, b.title, b.author, b.image_url
-           FROM checkouts c
-           JOIN books b ON c.book_id = b.book_id
-           WHERE c.checkout_id = ?''',
-        (checkout_id,)
-    )
-    checkout = cursor.fetchone()
-    conn.close()
+    checkout = _get_checkout(checkout_id, get_checkouts_version())
     
     if checkout:
-        return jsonify(dict(checkout)), 200
+        return jsonify(checkout), 200
     else:
         return jsonify({'error': 'Checkout not found'}), 404
 
 
+@ttl_cache(CHECKOUTS_TTL, maxsize=1024)
+def _get_checkout(checkout_id, checkouts_version):
+    """
+    Query one checkout with its book details, or None if it does not exist.
+    checkouts_version only forms part of the cache key.
+    """
+    conn = get_db()
+    cursor = row_cursor(conn)
+    
+    cursor.execute(SQL_GET_CHECKOUT, (checkout_id,))
+    checkout = cursor.fetchone()
+    
+    return dict(checkout) if checkout else None
+
+
 @checkouts_bp.route('/user/<int:user_id>/history', methods=['GET'])
 def get_user_checkout_history(user_id):
     """
     Get checkout history for a specific user.
     GET /api/checkouts/user/<user_id>/history
+    
+    Rows are serialized as they come off the cursor, so long histories
+    are never held in memory as a whole.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
+    cursor.arraysize = 200
     
-    cursor.execute(
-        '''SELECT c.*, b.title, b.author, b.year_published, b.genre, b.image_url
-           FROM checkouts c
-           JOIN books b ON c.book_id = b.book_id
-           WHERE c.user_id = ?
-           ORDER BY c.checkout_date DESC''',
-        (user_id,)
-    )
-    checkouts = cursor.fetchall()
-    conn.close()
+    cursor.execute(SQL_USER_HISTORY, (user_id,))
+    columns = [column[0] for column in cursor.description]
     
-    return jsonify({
-        'user_id': user_id,
-        'checkouts': [dict(checkout) for checkout in checkouts],
-        'total': len(checkouts)
-    }), 200
+    def generate():
+        yield b'{"user_id":%d,"checkouts":[' % user_id
+        total = 0
+        rows = cursor.fetchmany()
+        while rows:
+            separator = b',' if total else b''
+            total += len(rows)
+            yield separator + b','.join(orjson.dumps(dict(zip(columns, row)))
+                                        for row in rows)
+            rows = cursor.fetchmany()
+        
+        yield b'],"total":%d}\n' % total
+    
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
@@ -1,30 +1,113 @@
 """
 Homepage routes for the Library application.
 Contains the main page and recommendation logic.
-INTENTIONALLY INEFFICIENT for performance testing purposes.
 """
 
-from flask import Blueprint, request, jsonify, render_template
-from app.database import get_db_connection
-from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, render_template, current_app, Response
+from app.database import get_db, refresh_checkout_counts, BOOK_COLS, BOOK_COLUMNS
+from app.cache import ttl_cache, get_checkouts_version
+import hashlib
+import json
+import sqlite3
+import threading
+import time
 
 homepage_bp = Blueprint('homepage', __name__)
 
+# Seconds to cache trending books and per-user recommendations
+TRENDING_TTL = 60
+RECOMMENDATIONS_TTL = 300
+
+# Seconds between full recomputes of books.checkout_count_7d
+CHECKOUT_COUNTS_REFRESH = 3600
+
+_checkout_counts_refreshed_at = None
+_checkout_counts_lock = threading.Lock()
+
+# Rendered index.html and its ETag, filled on the first request
+_index_page = None
+
+# Hot queries kept as constants so every call hits the statement cache
+TRENDING_COLS = BOOK_COLS + ('checkout_count',)
+
+SQL_TRENDING_BOOKS = f'''
+    SELECT {BOOK_COLUMNS}, checkout_count_7d
+    FROM books
+    ORDER BY checkout_count_7d DESC
+    LIMIT 5
+'''
+
+SQL_RECENT_CHECKOUTS = '''
+    SELECT book_id FROM checkouts
+    WHERE user_id = ?
+    ORDER BY checkout_date DESC
+    LIMIT 3
+'''
+
+# Book fields rendered on recommendation cards
+RECOMMENDATION_COLS = ('book_id', 'title', 'author', 'year_published', 'genre',
+                       'image_url', 'is_booked', 'booked_by_user_id', 'due_date')
+RECOMMENDATION_COLUMNS = ', '.join('b.' + col for col in RECOMMENDATION_COLS)
+
+# The recent book ids are bound once as a JSON array, so the SQL text stays
+# the same however many recent books there are. Author and year branches
+# cannot repeat a book. Similar users contribute the 3 books they checked out
+# most recently; DISTINCT collapses books shared by several of them.
+SQL_RECOMMENDATIONS = '''
+    WITH recent(book_id) AS (SELECT value FROM json_each(?))
+    SELECT 'by_author' AS bucket, {cols}
+    FROM (SELECT DISTINCT author FROM books
+          WHERE book_id IN recent AND author != '') r
+    JOIN books b ON b.book_id IN (
+        SELECT book_id FROM books
+        WHERE author = r.author AND book_id NOT IN recent
+        LIMIT 5)
+    UNION ALL
+    SELECT 'by_year', {cols}
+    FROM (SELECT DISTINCT year_published FROM books
+          WHERE book_id IN recent AND year_published > 0) r
+    JOIN books b ON b.book_id IN (
+        SELECT book_id FROM books
+        WHERE year_published = r.year_published AND book_id NOT IN recent
+        LIMIT 5)
+    UNION ALL
+    SELECT DISTINCT 'similar_users', {cols}
+    FROM (SELECT book_id, ROW_NUMBER() OVER (
+                 PARTITION BY user_id ORDER BY MAX(checkout_date) DESC) AS rn
+          FROM checkouts
+          WHERE user_id IN (SELECT DISTINCT user_id FROM checkouts
+                            WHERE book_id IN recent AND user_id != ?
+                            LIMIT 5)
+            AND book_id NOT IN recent
+          GROUP BY user_id, book_id) s
+    JOIN books b ON b.book_id = s.book_id
+    WHERE s.rn <= 3
+'''.format(cols=RECOMMENDATION_COLUMNS)
 
 @homepage_bp.route('/')
 def index():
     """
     Render the homepage.
+    The template has no per-request content, so it is rendered once and
+    served from memory (re-rendered on every request in debug mode).
     """
-    return render_template('index.html')
+    global _index_page
+    
+    if _index_page is None or current_app.debug:
+        html = render_template('index.html').encode()
+        _index_page = (html, hashlib.sha1(html).hexdigest())
+    
+    html, etag = _index_page
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
 @homepage_bp.route('/api/homepage', methods=['GET'])
 def get_homepage_data():
     """
     Get all homepage data including trending and recommendations.
-    This endpoint is INTENTIONALLY INEFFICIENT - it recalculates
-    everything on every request without caching.
+    Both parts are served from in-process caches when fresh.
     
     GET /api/homepage?user_id=<int>
     """
@@ -44,56 +127,67 @@ def get_homepage_data():
     }), 200
 
 
+@ttl_cache(TRENDING_TTL)
 def get_trending_books():
     """
     Get top 5 trending books based on checkouts in the last 7 days.
-    INTENTIONALLY INEFFICIENT: No caching, calculates on every call.
+    Recalculated at most once every TRENDING_TTL seconds.
+    Reads the denormalized books.checkout_count_7d column, which is swept
+    for expired checkouts once every CHECKOUT_COUNTS_REFRESH seconds.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    global _checkout_counts_refreshed_at
     
-    seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db()
+    cursor = conn.cursor()
     
-    # Inefficient query: joins and aggregation without optimization
-    cursor.execute('''
-        SELECT b.*, COUNT(c.checkout_id) as checkout_count
-        FROM books b
-        LEFT JOIN checkouts c ON b.book_id = c.book_id
-        WHERE c.checkout_date >= ? OR c.checkout_date IS NULL
-        GROUP BY b.book_id
-        ORDER BY checkout_count DESC
-        LIMIT 5
-    ''', (seven_days_ago,))
+    # One thread sweeps at a time; the others serve the current counts,
+    # which the checkouts_ai trigger keeps up to date in the meantime
+    if _checkout_counts_lock.acquire(blocking=False):
+        try:
+            now = time.monotonic()
+            if (_checkout_counts_refreshed_at is None
+                    or now - _checkout_counts_refreshed_at >= CHECKOUT_COUNTS_REFRESH):
+                refresh_checkout_counts(conn)
+                _checkout_counts_refreshed_at = now
+        except sqlite3.OperationalError:
+            # Another writer held the database past the busy timeout;
+            # skip the sweep and retry on the next cache miss
+            conn.rollback()
+        finally:
+            _checkout_counts_lock.release()
+    
+    cursor.execute(SQL_TRENDING_BOOKS)
     
     trending = cursor.fetchall()
-    conn.close()
     
-    return [dict(book) for book in trending]
+    return [dict(zip(TRENDING_COLS, book)) for book in trending]
 
 
 def get_user_recommendations(user_id):
     """
     Get personalized recommendations for a user.
-    INTENTIONALLY INEFFICIENT: Multiple separate queries, no caching,
-    recalculates everything on every page load.
+    Results are cached per user until checkout data changes.
+    """
+    return _get_user_recommendations(user_id, get_checkouts_version())
+
+
+@ttl_cache(RECOMMENDATIONS_TTL, maxsize=1024)
+def _get_user_recommendations(user_id, checkouts_version):
     """
-    conn = get_db_connection()
+    Compute recommendations for a user.
+    Looks up the user's last 3 checkouts, then fetches every recommendation
+    type (same author, same year, similar users) in a single query.
+    checkouts_version only forms part of the cache key.
+    """
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get user's last 3 checkouts
-    cursor.execute('''
-        SELECT c.book_id, b.author, b.year_published, b.genre
-        FROM checkouts c
-        JOIN books b ON c.book_id = b.book_id
-        WHERE c.user_id = ?
-        ORDER BY c.checkout_date DESC
-        LIMIT 3
-    ''', (user_id,))
+    cursor.execute(SQL_RECENT_CHECKOUTS, (user_id,))
     
     recent_checkouts = cursor.fetchall()
     
     if not recent_checkouts:
-        conn.close()
         return {
             'by_author': [],
             'by_year': [],
@@ -101,94 +195,22 @@ def get_user_recommendations(user_id):
             'message': 'No checkout history found. Check out some books to get recommendations!'
         }
     
-    # Extract authors, years from recent checkouts
-    recent_authors = list(set([c['author'] for c in recent_checkouts if c['author']]))
-    recent_years = list(set([c['year_published'] for c in recent_checkouts if c['year_published']]))
-    recent_book_ids = [c['book_id'] for c in recent_checkouts]
-    
-    # INEFFICIENT: Separate query for each recommendation type
-    
-    # 1. Books by same author(s)
-    by_author = []
-    for author in recent_authors:
-        # Intentionally inefficient: separate query per author
-        cursor.execute('''
-            SELECT * FROM books
-            WHERE author = ? AND book_id NOT IN ({})
-            LIMIT 5
-        '''.format(','.join('?' * len(recent_book_ids))),
-        [author] + recent_book_ids)
-        by_author.extend([dict(b) for b in cursor.fetchall()])
-    
-    # 2. Books from same year(s)
-    by_year = []
-    for year in recent_years:
-        # Intentionally inefficient: separate query per year
-        cursor.execute('''
-            SELECT * FROM books
-            WHERE year_published = ? AND book_id NOT IN ({})
-            LIMIT 5
-        '''.format(','.join('?' * len(recent_book_ids))),
-        [year] + recent_book_ids)
-        by_year.extend([dict(b) for b in cursor.fetchall()])
-    
-    # 3. Books checked out by similar users
-    # VERY INEFFICIENT: Multiple nested queries
-    similar_users_books = []
-    
-    # Find users who checked out the same books
-    cursor.execute('''
-        SELECT DISTINCT user_id FROM checkouts
-        WHERE book_id IN ({}) AND user_id != ?
-    '''.format(','.join('?' * len(recent_book_ids))),
-    recent_book_ids + [user_id])
-    
-    similar_users = [row['user_id'] for row in cursor.fetchall()]
-    
-    # For each similar user, get their other checkouts
-    # INTENTIONALLY INEFFICIENT: Loop with individual queries
-    for similar_user_id in similar_users[:5]:  # Limit to 5 similar users
-        cursor.execute('''
-            SELECT DISTINCT b.*
-            FROM checkouts c
-            JOIN books b ON c.book_id = b.book_id
-            WHERE c.user_id = ? 
-            AND c.book_id NOT IN ({})
-            LIMIT 3
-        '''.format(','.join('?' * len(recent_book_ids))),
-        [similar_user_id] + recent_book_ids)
-        
-        similar_users_books.extend([dict(b) for b in cursor.fetchall()])
-    
-    conn.close()
-    
-    # Remove duplicates (inefficiently)
-    seen_ids = set()
-    unique_by_author = []
-    for book in by_author:
-        if book['book_id'] not in seen_ids:
-            seen_ids.add(book['book_id'])
-            unique_by_author.append(book)
-    
-    seen_ids_year = set()
-    unique_by_year = []
-    for book in by_year:
-        if book['book_id'] not in seen_ids_year:
-            seen_ids_year.add(book['book_id'])
-            unique_by_year.append(book)
-    
-    seen_ids_similar = set()
-    unique_similar = []
-    for book in similar_users_books:
-        if book['book_id'] not in seen_ids_similar:
-            seen_ids_similar.add(book['book_id'])
-            unique_similar.append(book)
+    recent_book_ids = [c[0] for c in recent_checkouts]
+    
+    # One round trip for all three recommendation types. Each branch is
+    # driven by the recent books and keeps the per-group limits: 5 books per
+    # author, 5 per year, 3 most recent per similar user (up to 5 similar users).
+    cursor.execute(SQL_RECOMMENDATIONS, (json.dumps(recent_book_ids), user_id))
+    
+    recommendations = {'by_author': [], 'by_year': [], 'similar_users': []}
+    for row in cursor.fetchall():
+        recommendations[row[0]].append(dict(zip(RECOMMENDATION_COLS, row[1:])))
     
     return {
-        'by_author': unique_by_author[:10],
-        'by_year': unique_by_year[:10],
-        'similar_users': unique_similar[:10],
-        'based_on_books': [c['book_id'] for c in recent_checkouts]
+        'by_author': recommendations['by_author'][:10],
+        'by_year': recommendations['by_year'][:10],
+        'similar_users': recommendations['similar_users'][:10],
+        'based_on_books': recent_book_ids
     }
 
 
@@ -198,9 +220,13 @@ def get_trending_endpoint():
     Get only trending books.
     GET /api/homepage/trending
     """
-    return jsonify({
+    response = jsonify({
         'trending': get_trending_books()
-    }), 200
+    })
+    response.cache_control.public = True
+    response.cache_control.max_age = TRENDING_TTL
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @homepage_bp.route('/api/homepage/recommendations/<int:user_id>', methods=['GET'])
@@ -3,11 +3,57 @@ User routes for the Library application.
 Handles user registration, login, and CRUD operations.
 """
 
+import hmac
+import sqlite3
 from flask import Blueprint, request, jsonify
-from app.database import get_db_connection
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.database import get_db
+from app.cache import ttl_cache
 
 users_bp = Blueprint('users', __name__)
 
+# Seconds to cache user lookups; every write to users clears the cache
+USER_TTL = 30
+
+# Prefixes of the hash formats werkzeug's generate_password_hash produces
+PASSWORD_HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+# Hot queries kept as constants so every call hits the statement cache
+SQL_INSERT_USER = 'INSERT INTO users (username, password) VALUES (?, ?)'
+SQL_GET_LOGIN = 'SELECT user_id, username, password FROM users WHERE username = ?'
+SQL_SET_PASSWORD = 'UPDATE users SET password = ? WHERE user_id = ?'
+SQL_GET_USER = 'SELECT user_id, username, created_at FROM users WHERE user_id = ?'
+SQL_USER_EXISTS = 'SELECT user_id FROM users WHERE user_id = ?'
+SQL_UPDATE_USER = 'UPDATE users SET username = ?, password = ? WHERE user_id = ?'
+SQL_DELETE_USER = 'DELETE FROM users WHERE user_id = ?'
+
+# Checked when a login names an unknown user, so the request costs the same
+# scrypt work as a real check and its timing does not reveal which names exist
+DUMMY_PASSWORD_HASH = generate_password_hash('dummy-password', method='scrypt')
+
+
+def credentials_error(data):
+    """
+    Validate a {"username", "password"} request body.
+    Returns a 400 response tuple, or None if both fields are strings.
+    """
+    if not data or 'username' not in data or 'password' not in data:
+        return jsonify({'error': 'Username and password are required'}), 400
+    if not isinstance(data['username'], str) or not isinstance(data['password'], str):
+        return jsonify({'error': 'Username and password must be strings'}), 400
+    return None
+
+
+def verify_password(stored, password):
+    """
+    Check a password against the stored value.
+    Accounts created before passwords were hashed still hold plaintext,
+    which is compared in constant time.
+    """
+    if stored.startswith(PASSWORD_HASH_PREFIXES):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
 
 @users_bp.route('', methods=['POST'])
 def register_user():
@@ -18,23 +64,24 @@ def register_user():
     """
     data = request.get_json()
     
-    if not data or 'username' not in data or 'password' not in data:
-        return jsonify({'error': 'Username and password are required'}), 400
+    error = credentials_error(data)
+    if error:
+        return error
     
     username = data['username']
     password = data['password']
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute(
-            'INSERT INTO users (username, password) VALUES (?, ?)',
-            (username, password)
+            SQL_INSERT_USER,
+            (username, generate_password_hash(password, method='scrypt'))
         )
         conn.commit()
+        _get_user.cache_clear()
         user_id = cursor.lastrowid
-        conn.close()
         
         return jsonify({
             'message': 'User registered successfully',
@@ -43,7 +90,6 @@ def register_user():
         }), 201
         
     except Exception as e:
-        conn.close()
         if 'UNIQUE constraint failed' in str(e):
             return jsonify({'error': 'Username already exists'}), 409
         return jsonify({'error': str(e)}), 500
@@ -58,27 +104,37 @@ def login_user():
     """
     data = request.get_json()
     
-    if not data or 'username' not in data or 'password' not in data:
-        return jsonify({'error': 'Username and password are required'}), 400
+    error = credentials_error(data)
+    if error:
+        return error
     
     username = data['username']
     password = data['password']
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute(
-        'SELECT user_id, username FROM users WHERE username = ? AND password = ?',
-        (username, password)
-    )
+    # Look the user up by the unique username, then verify the hash
+    cursor.execute(SQL_GET_LOGIN, (username,))
     user = cursor.fetchone()
-    conn.close()
     
-    if user:
+    if not user:
+        check_password_hash(DUMMY_PASSWORD_HASH, password)
+        return jsonify({'error': 'Invalid username or password'}), 401
+    
+    if verify_password(user[2], password):
+        if not user[2].startswith(PASSWORD_HASH_PREFIXES):
+            # Upgrade a plaintext password now that we know it
+            cursor.execute(
+                SQL_SET_PASSWORD,
+                (generate_password_hash(password, method='scrypt'), user[0])
+            )
+            conn.commit()
+        
         return jsonify({
             'message': 'Login successful',
-            'user_id': user['user_id'],
-            'username': user['username']
+            'user_id': user[0],
+            'username': user[1]
         }), 200
     else:
         return jsonify({'error': 'Invalid username or password'}), 401
@@ -90,26 +146,35 @@ def get_user(user_id):
     Get a specific user by ID.
     GET /api/users/<user_id>
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'SELECT user_id, username, created_at FROM users WHERE user_id = ?',
-        (user_id,)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    user = _get_user(user_id)
     
     if user:
-        return jsonify({
-            'user_id': user['user_id'],
-            'username': user['username'],
-            'created_at': user['created_at']
-        }), 200
+        return jsonify(user), 200
     else:
         return jsonify({'error': 'User not found'}), 404
 
 
+@ttl_cache(USER_TTL, maxsize=1024)
+def _get_user(user_id):
+    """
+    Query a user's public fields, or None if the user does not exist.
+    Cleared whenever a user is created, updated or deleted.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(SQL_GET_USER, (user_id,))
+    user = cursor.fetchone()
+    
+    if not user:
+        return None
+    return {
+        'user_id': user[0],
+        'username': user[1],
+        'created_at': user[2]
+    }
+
+
 @users_bp.route('/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     """
@@ -119,25 +184,25 @@ def update_user(user_id):
     """
     data = request.get_json()
     
-    if not data or 'username' not in data or 'password' not in data:
-        return jsonify({'error': 'Username and password are required'}), 400
+    error = credentials_error(data)
+    if error:
+        return error
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if user exists
-    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
+    cursor.execute(SQL_USER_EXISTS, (user_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({'error': 'User not found'}), 404
     
     try:
         cursor.execute(
-            'UPDATE users SET username = ?, password = ? WHERE user_id = ?',
-            (data['username'], data['password'], user_id)
+            SQL_UPDATE_USER,
+            (data['username'], generate_password_hash(data['password'], method='scrypt'), user_id)
         )
         conn.commit()
-        conn.close()
+        _get_user.cache_clear()
         
         return jsonify({
             'message': 'User updated successfully',
@@ -146,7 +211,6 @@ def update_user(user_id):
         }), 200
         
     except Exception as e:
-        conn.close()
         if 'UNIQUE constraint failed' in str(e):
             return jsonify({'error': 'Username already exists'}), 409
         return jsonify({'error': str(e)}), 500
@@ -158,17 +222,19 @@ def delete_user(user_id):
     Delete a user.
     DELETE /api/users/<user_id>
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if user exists
-    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
+    cursor.execute(SQL_USER_EXISTS, (user_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({'error': 'User not found'}), 404
     
-    cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    try:
+        cursor.execute(SQL_DELETE_USER, (user_id,))
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'User has checkouts or reviews and cannot be deleted'}), 409
     conn.commit()
-    conn.close()
+    _get_user.cache_clear()
     
     return jsonify({'message': 'User deleted successfully'}), 200
@@ -0,0 +1,4 @@
+"""
+Data import scripts for the Library application.
+Run them from the project root, e.g. python -m data.import_data
+"""
@@ -0,0 +1,26 @@
+"""
+Settings shared by the data import scripts.
+"""
+
+import secrets
+from werkzeug.security import generate_password_hash
+
+# One-shot bulk load settings: skip fsync, keep temp data in memory and give
+# SQLite a 200MB page cache. The CSV can simply be re-imported if the load is
+# interrupted. The journal stays in WAL so the app can keep serving meanwhile.
+BULK_LOAD_PRAGMAS = '''
+    PRAGMA synchronous = OFF;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -200000;
+'''
+
+# Account the imported ratings are stored under
+RATINGS_USERNAME = 'ratings_import'
+
+
+def unusable_password():
+    """
+    Hash a random token that is thrown away, so nobody can log in as the
+    account it is stored for.
+    """
+    return generate_password_hash(secrets.token_urlsafe(32), method='scrypt')
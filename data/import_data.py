@@ -1,7 +1,63 @@
 import sqlite3
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from itertools import repeat
 import os
+from data.common import BULK_LOAD_PRAGMAS
+
+# Arrow's CSV reader tokenizes in parallel across cores; fall back to the
+# pandas C parser when pyarrow is not installed (see requirements-import.txt)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+SQL_INSERT_BOOK = '''
+    INSERT INTO books
+    (isbn, title, author, year_published, genre, image_url,
+     is_booked, booked_by_user_id, due_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Books.csv columns the importer reads; the rest (e.g. Publisher) are never parsed
+CSV_COLUMNS = ['ISBN', 'Book-Title', 'Book-Author', 'Year-Of-Publication',
+               'Image-URL-S', 'Image-URL-M', 'Image-URL-L']
+
+# Values pandas reads as missing by default; Arrow's own list lacks 'None'
+# and '<NA>', so it is given this one to produce the same frame
+CSV_NULL_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+                   '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+                   'None', 'n/a', 'nan', 'null']
+
+def read_books_csv(csv_file, engine=CSV_ENGINE):
+    """
+    Read the CSV_COLUMNS of Books.csv as strings, with missing values as NaN/None.
+    Every column is declared as a string up front so Arrow never infers
+    numbers (which would strip the leading zeros off ISBNs).
+    """
+    if engine != 'pyarrow':
+        return pd.read_csv(csv_file, dtype=str, usecols=CSV_COLUMNS)
+    
+    table = pa_csv.read_csv(
+        csv_file,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=CSV_COLUMNS,
+            column_types={column: pa.string() for column in CSV_COLUMNS},
+            null_values=CSV_NULL_VALUES,
+            strings_can_be_null=True
+        )
+    )
+    return table.to_pandas()
+
+def to_column(series):
+    """
+    Convert a pandas Series to a list of Python values with None for missing entries
+    """
+    return series.astype(object).where(series.notna(), None).tolist()
 
 def insert_books_to_db(csv_file, db_file):
     """
@@ -23,113 +79,96 @@ def insert_books_to_db(csv_file, db_file):
     try:
         # Load cleaned CSV
         print(f"\n--- Loading CSV ---")
-        df = pd.read_csv(csv_file, dtype=str)
-        print(f"Loaded {len(df)} records from CSV")
+        df = read_books_csv(csv_file)
+        print(f"Loaded {len(df)} records from CSV ({CSV_ENGINE} parser)")
         print(f"Columns: {list(df.columns)}")
         
         # Connect to database
         print(f"\n--- Connecting to Database ---")
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
+        cursor.executescript(BULK_LOAD_PRAGMAS)
         print(f"✓ Connected to {db_file}")
         
         # Prepare data for insertion
         print(f"\n--- Preparing Data ---")
-        
-        # Map CSV columns to database columns
-        # We'll use the first (largest) image URL
-        books_to_insert = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Extract year as integer or None
-                year = None
-                if pd.notna(row.get('Year-Of-Publication')):
-                    try:
-                        year = int(float(row['Year-Of-Publication']))
-                    except:
-                        year = None
-                
-                # Get the largest image URL (or medium, or small as fallback)
-                image_url = None
-                if pd.notna(row.get('Image-URL-L')):
-                    image_url = row['Image-URL-L']
-                elif pd.notna(row.get('Image-URL-M')):
-                    image_url = row['Image-URL-M']
-                elif pd.notna(row.get('Image-URL-S')):
-                    image_url = row['Image-URL-S']
-                
-                # Prepare tuple for insertion
-                book_data = (
-                    row.get('ISBN', ''),                    # isbn
-                    row.get('Book-Title', 'Unknown'),       # title
-                    row.get('Book-Author', 'Unknown'),      # author
-                    year,                                    # year_published
-                    None,                                    # genre (not in CSV)
-                    image_url,                              # image_url
-                    0,                                       # is_booked (default)
-                    None,                                    # booked_by_user_id (default)
-                    None                                     # due_date (default)
-                )
-                
-                books_to_insert.append(book_data)
-                
-            except Exception as e:
-                print(f"Warning: Skipping row {idx} due to error: {e}")
-                continue
+        csv_count = len(df)
+        
+        # Drop every row the books table would reject, so the inserts below
+        # never hit a constraint: ISBNs repeated in the CSV or already
+        # imported, and rows without a title or author
+        cursor.execute("SELECT isbn FROM books WHERE isbn IS NOT NULL")
+        existing_isbns = {row[0] for row in cursor.fetchall()}
+        duplicate = df['ISBN'].notna() & (df['ISBN'].duplicated() | df['ISBN'].isin(existing_isbns))
+        keep = ~duplicate & df['Book-Title'].notna() & df['Book-Author'].notna()
+        skipped_count = int((~keep).sum())
+        df = df[keep]
+        
+        # Derive every column for the whole frame at once with vectorized
+        # pandas/NumPy operations instead of a Python loop over rows
+        
+        # Year as an integer, or None when missing or not a finite number
+        years = pd.to_numeric(df['Year-Of-Publication'], errors='coerce')
+        years = np.trunc(years.where(np.isfinite(years))).astype('Int64')
+        
+        # Get the largest image URL (or medium, or small as fallback)
+        image_urls = df['Image-URL-L'].fillna(df['Image-URL-M']).fillna(df['Image-URL-S'])
+        
+        books_to_insert = list(zip(
+            to_column(df['ISBN']),                  # isbn
+            to_column(df['Book-Title']),            # title
+            to_column(df['Book-Author']),           # author
+            to_column(years),                       # year_published
+            repeat(None),                           # genre (not in CSV)
+            to_column(image_urls),                  # image_url
+            repeat(0),                              # is_booked (default)
+            repeat(None),                           # booked_by_user_id (default)
+            repeat(None)                            # due_date (default)
+        ))
         
         print(f"Prepared {len(books_to_insert)} records for insertion")
         
         # Insert data
         print(f"\n--- Inserting Data ---")
         
-        insert_query = '''
-            INSERT OR IGNORE INTO books 
-            (isbn, title, author, year_published, genre, image_url, 
-             is_booked, booked_by_user_id, due_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        
-        # Insert in batches for better performance
-        batch_size = 1000
+        # Insert in large batches inside a single transaction so the
+        # whole import pays for one commit instead of one per batch
+        batch_size = 5000
         inserted_count = 0
-        skipped_count = 0
         
-        for i in range(0, len(books_to_insert), batch_size):
-            batch = books_to_insert[i:i + batch_size]
+        with conn:
+            cursor.execute("BEGIN")
+            
+            # Updating books_fts from a trigger on every row slows the load
+            # down more with each batch; set the trigger aside and rebuild
+            # the full-text index once at the end of the transaction
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'books_fts_ai'")
+            fts_trigger = cursor.fetchone()
+            if fts_trigger:
+                cursor.execute("DROP TRIGGER books_fts_ai")
             
-            try:
-                cursor.executemany(insert_query, batch)
+            for i in range(0, len(books_to_insert), batch_size):
+                batch = books_to_insert[i:i + batch_size]
+                
+                cursor.executemany(SQL_INSERT_BOOK, batch)
                 inserted_count += cursor.rowcount
-                conn.commit()
                 
                 # Progress update
                 progress = min(i + batch_size, len(books_to_insert))
                 print(f"✓ Progress: {progress}/{len(books_to_insert)} records processed")
-                
-            except sqlite3.IntegrityError as e:
-                print(f"Warning: Some records in batch {i//batch_size + 1} skipped (likely duplicates)")
-                skipped_count += len(batch)
-                conn.rollback()
-                
-                # Try inserting individually to skip only duplicates
-                for book in batch:
-                    try:
-                        cursor.execute(insert_query, book)
-                        inserted_count += cursor.rowcount
-                    except sqlite3.IntegrityError:
-                        skipped_count += 1
-                
-                conn.commit()
+            
+            if fts_trigger:
+                cursor.execute(fts_trigger[0])
+                cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+                print(f"✓ Rebuilt full-text index")
         
         # Create indexes for better query performance
         print(f"\n--- Creating Indexes ---")
         
+        # isbn already has the UNIQUE constraint's index, and init_db()
+        # creates the author and year indexes
         indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_isbn ON books(isbn)",
             "CREATE INDEX IF NOT EXISTS idx_title ON books(title)",
-            "CREATE INDEX IF NOT EXISTS idx_author ON books(author)",
-            "CREATE INDEX IF NOT EXISTS idx_year ON books(year_published)",
             "CREATE INDEX IF NOT EXISTS idx_is_booked ON books(is_booked)"
         ]
         
@@ -151,9 +190,9 @@ def insert_books_to_db(csv_file, db_file):
         print("\n" + "="*50)
         print("INSERTION SUMMARY")
         print("="*50)
-        print(f"Records in CSV: {len(books_to_insert)}")
+        print(f"Records in CSV: {csv_count}")
         print(f"Records inserted: {inserted_count}")
-        print(f"Records skipped (duplicates): {skipped_count}")
+        print(f"Records skipped (duplicates or missing title/author): {skipped_count}")
         print(f"Total records in database: {total_in_db}")
         print("="*50)
         
@@ -166,9 +205,10 @@ def insert_books_to_db(csv_file, db_file):
         return False
 
 if __name__ == "__main__":
-    # File paths
-    csv_file = r"data\Books.csv"
-    db_file = r"data\library.db"
+    # File paths (use script directory so running from any CWD works)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    csv_file = os.path.join(script_dir, "Books.csv")
+    db_file = os.path.join(script_dir, "library.db")
     
     # Run insertion
     success = insert_books_to_db(csv_file, db_file)
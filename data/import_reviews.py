@@ -1,7 +1,9 @@
 import sqlite3
 import pandas as pd
 from datetime import datetime
+from itertools import repeat
 import os
+from data.common import BULK_LOAD_PRAGMAS, RATINGS_USERNAME, unusable_password
 
 def insert_reviews_to_db(csv_file, db_file):
     # Check if files exist
@@ -16,55 +18,66 @@ def insert_reviews_to_db(csv_file, db_file):
     try:
         # Load CSV
         print(f"\n--- Loading CSV ---")
-        df = pd.read_csv(csv_file, dtype=str)
+        df = pd.read_csv(csv_file, dtype=str, usecols=['ISBN', 'Book-Rating'])
         print(f"Loaded {len(df)} records from CSV")
 
         # Connect to database
         print(f"\n--- Connecting to Database ---")
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
+        cursor.executescript(BULK_LOAD_PRAGMAS)
         print(f"✓ Connected to {db_file}")
 
-        # Determine a synthetic user_id that is not used by any real user
-        cursor.execute("SELECT MAX(user_id) FROM users")
+        # Store the ratings under a real account so the foreign key holds and
+        # the id is never reused by a registering user
+        cursor.execute("SELECT user_id FROM users WHERE username = ?", (RATINGS_USERNAME,))
         row = cursor.fetchone()
-        max_user_id = row[0] if row and row[0] is not None else 0
-        synthetic_user_id = int(max_user_id) + 1
+        if row:
+            synthetic_user_id = row[0]
+        else:
+            cursor.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                (RATINGS_USERNAME, unusable_password())
+            )
+            synthetic_user_id = cursor.lastrowid
         print(f"Using synthetic user_id: {synthetic_user_id}")
 
         insert_query = (
             "INSERT INTO reviews (user_id, book_id, rating) VALUES (?, ?, ?)"
         )
 
-        inserted_count = 0
+        # Load the ISBN -> book_id mapping with one scan instead of
+        # looking up every rating's book separately. A Series indexed by ISBN
+        # keeps the lookup table in pandas' hash index, which is smaller
+        # than a dict of Python strings and is probed in C by Series.map
+        isbn_to_id = pd.read_sql_query(
+            "SELECT isbn, book_id FROM books WHERE isbn IS NOT NULL",
+            conn, index_col='isbn'
+        )['book_id']
 
-        for idx, r in df.iterrows():
-            try:
-                # Only accept ratings > 0
-                rating = int(r['Book-Rating']) if pd.notna(r['Book-Rating']) else None
-                if rating is None or rating <= 0:
-                    continue
+        # Only accept ratings > 0 that carry an ISBN
+        df = df.assign(rating=pd.to_numeric(df['Book-Rating'], errors='coerce'))
+        df = df[(df['rating'] > 0) & (df['rating'] <= 10) & df['ISBN'].notna()]
 
-                isbn = r['ISBN'] if pd.notna(r['ISBN']) else None
-                if not isbn:
-                    continue
+        # Find matching book_id for every rating by ISBN
+        df = df.assign(book_id=df['ISBN'].map(isbn_to_id))
+        missing = df['book_id'].isna()
+        if missing.any():
+            print(f"✗ No book found for {int(missing.sum())} ratings")
+        df = df[~missing]
 
-                # Find matching book_id in books table by ISBN
-                cursor.execute("SELECT book_id FROM books WHERE isbn = ?", (isbn,))
-                book_row = cursor.fetchone()
-                if not book_row:
-                    print(f"✗ No book found for ISBN {isbn} (row {idx})")
-                    continue
+        reviews = list(zip(
+            repeat(synthetic_user_id),
+            df['book_id'].astype(int).tolist(),
+            df['rating'].astype(int).tolist()
+        ))
 
-                book_id = book_row[0]
-
-                cursor.execute(insert_query, (synthetic_user_id, book_id, rating))
-                inserted_count += 1
-            except Exception as e:
-                print(f"✗ Error processing row {idx}: {e}")
+        cursor.executemany(insert_query, reviews)
+        inserted_count = len(reviews)
 
         conn.commit()
         print(f"Inserted {inserted_count} reviews with user_id {synthetic_user_id}")
+        conn.close()
         return True
     except Exception as e:
         print(f"\n✗ Error during insertion: {e}")
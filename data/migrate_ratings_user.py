@@ -0,0 +1,66 @@
+import sqlite3
+import os
+from data.common import RATINGS_USERNAME, unusable_password
+
+def migrate_ratings_user(db_file):
+    """
+    Give reviews imported before the ratings account existed a real owner.
+    Older imports stored them under a user_id with no users row, which the
+    next user to register would have inherited.
+    """
+    if not os.path.exists(db_file):
+        print(f"✗ Database file not found: {db_file}")
+        return False
+
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT DISTINCT user_id FROM reviews
+        WHERE user_id NOT IN (SELECT user_id FROM users)
+    """)
+    orphan_ids = [row[0] for row in cursor.fetchall()]
+    if not orphan_ids:
+        print("✓ No orphaned reviews found")
+        conn.close()
+        return True
+
+    # Reuse the account the importer creates, or adopt the first orphaned id
+    # for it so those reviews need no rewrite. That id has no users row and
+    # the username is free, so the insert cannot collide.
+    cursor.execute("SELECT user_id FROM users WHERE username = ?", (RATINGS_USERNAME,))
+    row = cursor.fetchone()
+    if row:
+        ratings_user_id = row[0]
+    else:
+        ratings_user_id = orphan_ids[0]
+        cursor.execute(
+            "INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)",
+            (ratings_user_id, RATINGS_USERNAME, unusable_password())
+        )
+
+    # Any other orphaned reviews move to the same account
+    cursor.execute("""
+        UPDATE reviews SET user_id = ?
+        WHERE user_id NOT IN (SELECT user_id FROM users)
+    """, (ratings_user_id,))
+    moved_count = cursor.rowcount
+
+    conn.commit()
+    conn.close()
+
+    print(f"✓ Orphaned reviews now belong to '{RATINGS_USERNAME}' (user_id {ratings_user_id})")
+    print(f"Reviews moved from other ids: {moved_count}")
+    return True
+
+if __name__ == "__main__":
+    # File paths (use script directory so running from any CWD works)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    db_file = os.path.join(script_dir, "library.db")
+
+    success = migrate_ratings_user(db_file)
+
+    if success:
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
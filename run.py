@@ -1,9 +1,12 @@
 """
 Main entry point for the Library application.
-Run this file to start the Flask development server.
+Run this file to start the server: waitress with a pool of worker threads,
+or the Flask development server when FLASK_DEBUG=1.
 """
 
+import os
 from app import create_app
+from app.database import WEB_THREADS
 
 app = create_app()
 
@@ -11,4 +14,8 @@ if __name__ == '__main__':
     print("Starting Library Web Server...")
     print("Access the application at: http://localhost:5000")
     print("API endpoints available at: http://localhost:5000/api/")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if os.environ.get('FLASK_DEBUG') == '1':
+        app.run(host='0.0.0.0', port=5000, debug=True)
+    else:
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5000, threads=WEB_THREADS)
@@ -0,0 +1,17 @@
+#Tests for the data import scripts
+import os
+import pandas as pd
+import pytest
+from data.import_data import read_books_csv
+
+CSV_PATH = 'data/Books.csv'
+
+#both parsers must hand the importer the same frame, or the pyarrow path changes imported data
+def test_books_csv_engines_match():
+    pytest.importorskip('pyarrow')
+    if not os.path.exists(CSV_PATH):
+        pytest.skip(f"CSV file not found: {CSV_PATH}")
+
+    pandas_frame = read_books_csv(CSV_PATH, engine='c')
+    arrow_frame = read_books_csv(CSV_PATH, engine='pyarrow')
+    pd.testing.assert_frame_equal(pandas_frame, arrow_frame)